@@ -1,8 +1,9 @@
 from typing import TYPE_CHECKING
 
 import csv
-import time
+import queue
 import logging
+import threading
 
 try:
     import winsound
@@ -12,13 +13,13 @@ except ImportError:
 import numpy as np
 if TYPE_CHECKING:  # use the PyQt6 stubs for typechecking,
     # as they are the nicest
-    from PyQt6.QtCore import QObject, QThread, pyqtSignal as Signal
+    from PyQt6.QtCore import QObject, QThread, QTimer, pyqtSignal as Signal
     from PyQt6.QtWidgets import (QWidget, QFrame, QBoxLayout, QGroupBox,
                                  QFormLayout, QDoubleSpinBox, QSpinBox,
                                  QVBoxLayout, QCheckBox, QPushButton,
                                  QErrorMessage, QFileDialog)
 else:
-    from pyqtgraph.Qt.QtCore import QObject, QThread, Signal
+    from pyqtgraph.Qt.QtCore import QObject, QThread, QTimer, Signal
     from pyqtgraph.Qt.QtWidgets import (QWidget, QFrame, QBoxLayout, QGroupBox,
                                         QFormLayout, QDoubleSpinBox, QSpinBox,
                                         QVBoxLayout, QCheckBox, QPushButton,
@@ -28,11 +29,45 @@ from reflectance_measure.stage.stage_utils import Stage
 from reflectance_measure.daq.daq_utils import DAQ
 
 
+def debounce(slot, interval: int = 150):
+    '''
+    wrap `slot` so that a burst of calls only forwards the last arguments,
+    once no new call has arrived for `interval` ms.
+    call `.flush()` on the result to forward a pending call immediately.
+    '''
+    timer: QTimer | None = None
+    last_args = ()
+
+    def _fire():
+        slot(*last_args)
+
+    def _func(*args):
+        nonlocal timer, last_args
+        last_args = args
+        if timer is None:
+            timer = QTimer()
+            timer.setSingleShot(True)
+            timer.setInterval(interval)
+            timer.timeout.connect(_fire)
+        timer.start()
+
+    def _flush():
+        if timer is not None and timer.isActive():
+            timer.stop()
+            _fire()
+
+    _func.flush = _flush
+    return _func
+
+
 class ExperimentAutomation(QObject):
     sig_measurement_finished = Signal()
     sig_measurement_failed = Signal(Exception)
     sig_measurement_added = Signal(tuple)
 
+    WAIT_POLL = 0.1
+    '''interval [s] at which the stage is polled while waiting for it'''
+
     def __init__(self, parent: QObject | None = None,
                  stage: Stage | None = None, daq: DAQ | None = None) -> None:
         super().__init__(parent)
@@ -50,12 +85,24 @@ class ExperimentAutomation(QObject):
 
         self.save_file: str | None = None
 
-        self._measurements = []
+        self.current_save_path: str | None = None
+        '''the file the last measurement routine was streamed to, if any'''
+        self.stream_complete = False
+        '''whether the stream to `current_save_path` was written out cleanly'''
+
+        self._measurements = np.empty((0, 2))
+        self._nb_taken = 0
+
+        self._cancel = threading.Event()
+        '''set from any thread to stop the running measurement routine'''
+
+        self._save_error: Exception | None = None
+        '''set by the background writer if saving the measurements failed'''
 
     @property
-    def measurements(self) -> list[tuple[float, float]]:
-        '''last measurements taken'''
-        return self._measurements
+    def measurements(self) -> np.ndarray:
+        '''last measurements taken, as (angle, value) rows'''
+        return self._measurements[:self._nb_taken]
 
     def set_start_angle(self, value: float):
         self.start_angle = value
@@ -75,6 +122,85 @@ class ExperimentAutomation(QObject):
     def set_save_file(self, filename: str):
         self.save_file = filename
 
+    def angles(self) -> np.ndarray:
+        '''the grid of angles the measurement routine will visit'''
+        return np.arange(
+            self.start_angle,
+            self.end_angle + self.increment_angle/10,
+            self.increment_angle
+        )
+
+    def cancel(self):
+        '''
+        ask the running measurement routine to stop. this is thread-safe,
+        and should be called directly rather than through a queued signal,
+        since the routine blocks this object's thread.
+        '''
+        self._cancel.set()
+
+    def clear_cancel(self):
+        '''
+        re-arm the routine after a cancellation. call this before
+        `do_measurement` is queued, so a cancel issued after that
+        cannot be lost.
+        '''
+        self._cancel.clear()
+
+    def _wait_for_stage(self) -> bool:
+        '''
+        wait until the stage is no longer busy, or until the routine is
+        cancelled. returns False if it was cancelled.
+        '''
+        while self._stage.is_busy():
+            if self._cancel.wait(self.WAIT_POLL):
+                return False
+        # check to make sure there was no error
+        ec, msg = self._stage.error_status()
+        if ec != 0:
+            raise RuntimeError(f"MOTOR ERROR {ec} : {msg}")
+        return True
+
+    def _read_values(self):
+        '''
+        take the measurements for one angle, yielding them in batches,
+        checking for cancellation in between.
+        '''
+        n = self.nb_measurements
+        if n > 1 and self.measurement_interval > 0:
+            # a single acquisition, which stops early when cancelled
+            yield self._daq.read_n(n, 1./self.measurement_interval,
+                                   cancel=self._cancel)
+        else:
+            for _ in range(n):
+                if self._cancel.is_set():
+                    return
+                yield [self._daq.read_channel()]
+
+    def _save_worker(self, file, save_q: queue.Queue):
+        '''
+        write the rows put in `save_q` to `file`, until `None` is received.
+        the file is flushed whenever the queue runs dry, and closed at the end.
+        '''
+        try:
+            writer = csv.writer(file, lineterminator='\n')
+            writer.writerow(["angle [deg]", "intensity [V]"])
+            while (row := save_q.get()) is not None:
+                writer.writerow(row)
+                if save_q.empty():
+                    file.flush()
+        except Exception as e:
+            self._logger.exception(e)
+            self._save_error = e
+        finally:
+            file.close()
+
+    def _check_save_error(self):
+        '''raise if the background writer failed, to abort the routine'''
+        if self._save_error is not None:
+            raise RuntimeError(
+                f"failed to save to {self.current_save_path}"
+            ) from self._save_error
+
     @staticmethod
     def catch_exception(func):
         def _func(self, *args, **kwargs):
@@ -93,6 +219,8 @@ class ExperimentAutomation(QObject):
         emits the `sig_measurement_finished` signal when it is done.
         '''
         self._logger.debug("starting measurement routine")
+        self.current_save_path = None
+        self.stream_complete = False
 
         # enable motor if required
         if not self._stage.enabled():
@@ -104,40 +232,59 @@ class ExperimentAutomation(QObject):
             self._logger.debug("initiating homeing")
             self._stage.goto_home()
         # make sure the stage is stationary before continuing
-        self._stage.wait_until_done()
-
-        # reset the list to contain measurements
-        self._measurements = []
+        if not self._wait_for_stage():
+            self._logger.debug("measurement routine cancelled")
+            return
 
         # prepare measurement angles list
-        angles = np.arange(
-            self.start_angle,
-            self.end_angle + self.increment_angle/10,
-            self.increment_angle
-        )
+        angles = self.angles()
+
+        # reset the array to contain measurements
+        self._measurements = np.empty((angles.size*self.nb_measurements, 2))
+        self._nb_taken = 0
+
+        # open the save file once, and hand rows to a background writer,
+        # so the measurement loop never waits on the disk
+        save_q: queue.Queue | None = None
+        save_thread: threading.Thread | None = None
+        self._save_error = None
+        if self.save_file:
+            file = open(self.save_file, 'w', newline='', buffering=1 << 16)
+            self.current_save_path = self.save_file
+            save_q = queue.Queue()
+            save_thread = threading.Thread(target=self._save_worker,
+                                           args=(file, save_q),
+                                           daemon=True)
+            save_thread.start()
 
-        # do measurements at each angle
-        last_save_time = time.time()
-        for angle in angles:
-            self._logger.debug(f"{angle=}°deg")
-            self._stage.goto_position(-angle)
-            self._stage.wait_until_done()
-            # time.sleep(min(1, self.increment_angle*5))
-
-            for i in range(self.nb_measurements):
-                self._logger.debug(f"measurement {i}")
-                value = self._daq.read_channel()
-                self._measurements.append((angle, value))
-                self.sig_measurement_added.emit((angle, value))
-
-                if i + 1 < self.nb_measurements:
-                    time.sleep(self.measurement_interval)
-
-            if self.save_file and (time.time() - last_save_time > 1):
-                with open(self.save_file, 'w') as file:
-                    writer = csv.writer(file, lineterminator='\n')
-                    writer.writerow(["angle [deg]", "intensity [V]"])
-                    writer.writerows(self.measurements)
+        try:
+            # do measurements at each angle
+            for angle in angles:
+                if self._cancel.is_set():
+                    self._logger.debug("measurement routine cancelled")
+                    return
+                self._check_save_error()
+                self._logger.debug(f"{angle=}°deg")
+                self._stage.goto_position(-angle)
+                if not self._wait_for_stage():
+                    self._logger.debug("measurement routine cancelled")
+                    return
+                # time.sleep(min(1, self.increment_angle*5))
+
+                # keep every acquired sample, even if cancelled meanwhile
+                for values in self._read_values():
+                    for value in values:
+                        self._measurements[self._nb_taken] = angle, value
+                        self._nb_taken += 1
+                        self.sig_measurement_added.emit((angle, value))
+                        if save_q is not None:
+                            save_q.put((angle, value))
+        finally:
+            if save_thread is not None:
+                save_q.put(None)
+                save_thread.join()
+                self._check_save_error()
+                self.stream_complete = True
 
         self.sig_measurement_finished.emit()
 
@@ -153,6 +300,9 @@ class ExperimentAutomationWidget(QFrame):
         self._logger = logging.getLogger(self.__class__.__name__)
 
         self._t = QThread(self)
+        self._t.finished.connect(self._thread_finished)
+        self._running = False
+        self._stopping = False
 
         self._ea = ExperimentAutomation(stage=stage, daq=daq)
         self._ea.moveToThread(self._t)
@@ -164,6 +314,9 @@ class ExperimentAutomationWidget(QFrame):
         self._layout = QBoxLayout(QBoxLayout.Direction.LeftToRight)
         self.setLayout(self._layout)
 
+        # parameter changes are debounced, to avoid flooding the worker
+        self._param_setters = []
+
         # layout - parameter box
         self._params_box = QGroupBox("Parameters", self)
         self._params_box.setLayout(QFormLayout())
@@ -173,13 +326,15 @@ class ExperimentAutomationWidget(QFrame):
         self._start_angle.setRange(0., 90.)
         self._start_angle.setValue(self._ea.start_angle)
         self._params_box.layout().addRow("start angle", self._start_angle)
-        self._start_angle.valueChanged.connect(self._ea.set_start_angle)
+        self._start_angle.valueChanged.connect(
+            self._debounced(self._ea.set_start_angle))
 
         self._end_angle = QDoubleSpinBox(self._params_box)
         self._end_angle.setRange(0., 90.)
         self._end_angle.setValue(self._ea.end_angle)
         self._params_box.layout().addRow("end angle", self._end_angle)
-        self._end_angle.valueChanged.connect(self._ea.set_end_angle)
+        self._end_angle.valueChanged.connect(
+            self._debounced(self._ea.set_end_angle))
 
         self._angle_increment = QDoubleSpinBox(self._params_box)
         self._angle_increment.setRange(0.01, 90.)
@@ -187,21 +342,21 @@ class ExperimentAutomationWidget(QFrame):
         self._params_box.layout().addRow("angle increment",
                                          self._angle_increment)
         self._angle_increment.valueChanged.connect(
-            self._ea.set_increment_angle)
+            self._debounced(self._ea.set_increment_angle))
 
         self._nb_measurements = QSpinBox(self._params_box)
         self._nb_measurements.setValue(self._ea.nb_measurements)
         self._params_box.layout().addRow("nb measurements",
                                          self._nb_measurements)
         self._nb_measurements.valueChanged.connect(
-            self._ea.set_nb_measurements)
+            self._debounced(self._ea.set_nb_measurements))
 
         self._measurement_interval = QDoubleSpinBox(self._params_box)
         self._measurement_interval.setValue(self._ea.measurement_interval)
         self._params_box.layout().addRow("measurement interval",
                                          self._measurement_interval)
         self._measurement_interval.valueChanged.connect(
-            self._ea.set_measurement_interval)
+            self._debounced(self._ea.set_measurement_interval))
 
         # layout - startbutton
         self._startbutton_box = QFrame(self)
@@ -233,8 +388,29 @@ class ExperimentAutomationWidget(QFrame):
         # error msg
         self._error_handler = QErrorMessage(self)
 
+    @property
+    def automation(self) -> ExperimentAutomation:
+        '''the ExperimentAutomation instance belonging to this widget'''
+        return self._ea
+
+    @property
+    def running(self) -> bool:
+        '''whether a measurement is currently running'''
+        return self._running
+
+    def _debounced(self, slot):
+        setter = debounce(slot)
+        self._param_setters.append(setter)
+        return setter
+
     def _measurement_started(self):
         self._logger.info("starting measurement")
+        self._running = True
+        # re-arm before the routine is queued, so an early cancel sticks
+        self._ea.clear_cancel()
+        # make sure the latest parameters have reached the automation
+        for setter in self._param_setters:
+            setter.flush()
         self._t.start()
         self._params_box.setDisabled(True)
         self._start_button.setDisabled(True)
@@ -243,8 +419,20 @@ class ExperimentAutomationWidget(QFrame):
         self.sig_experiment_started.emit()
 
     def _measurement_done(self):
+        # cancelling and failing both end up here, only tear down once
+        if not self._running or self._stopping:
+            return
+        self._stopping = True
         self._logger.info("measurement finished")
-        self._t.terminate()
+        self._cancel_button.setDisabled(True)
+        self._stop_thread()
+
+    def _thread_finished(self):
+        '''the worker thread has exited, a new measurement can be started'''
+        if not self._running:
+            return
+        self._running = False
+        self._stopping = False
         self._params_box.setEnabled(True)
         self._start_button.setEnabled(True)
         self._cancel_button.setDisabled(True)
@@ -256,8 +444,16 @@ class ExperimentAutomationWidget(QFrame):
 
         self.sig_experiment_finished.emit()
 
+    def _stop_thread(self):
+        '''
+        cancel the measurement routine and let the worker thread exit.
+        this does not wait: `_thread_finished` runs once it has exited.
+        '''
+        self._ea.cancel()
+        self._t.quit()
+
     def _cancel_measurement(self):
-        self._t.terminate()
+        self._ea.cancel()
         try:
             self._ea._stage.stop()
             self._logger.info("measurement cancelled")
@@ -291,5 +487,7 @@ class ExperimentAutomationWidget(QFrame):
             self._ea.save_file = None
 
     def close(self) -> None:
-        self._t.terminate()
+        self._stop_thread()
+        if not self._t.wait(2000):
+            self._logger.warning("measurement thread did not exit in time")
         return super().close()
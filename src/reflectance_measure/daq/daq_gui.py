@@ -4,19 +4,22 @@ import logging
 import pyqtgraph as pg
 if TYPE_CHECKING:  # use the PyQt6 stubs for typechecking, as they are the nicest
     try:
-        from PyQt6.QtCore import Qt, QTimer
+        from PyQt6.QtCore import Qt, QTimer, pyqtSignal as Signal
         from PyQt6.QtWidgets import *
     except ImportError:
-        from PyQt5.QtCore import Qt, QTimer
+        from PyQt5.QtCore import Qt, QTimer, pyqtSignal as Signal
         from PyQt5.QtWidgets import *
 else:
-    from pyqtgraph.Qt.QtCore import Qt, QTimer
+    from pyqtgraph.Qt.QtCore import Qt, QTimer, Signal
     from pyqtgraph.Qt.QtWidgets import *
 
 from reflectance_measure.daq.daq_utils import DAQ
 
 
 class DAQSelector(QGroupBox):
+    sig_channel_changed = Signal(bool)
+    '''emitted with whether a channel is set, whenever that may have changed'''
+
     def __init__(self, parent: QWidget | None = None, daq: DAQ | None = None) -> None:
         super().__init__("Connection", parent)
         self._logger = logging.getLogger(self.__class__.__name__)
@@ -45,10 +48,12 @@ class DAQSelector(QGroupBox):
     def _update_device_list(self):
         '''update the device drop-down selector'''
         self._logger.debug("updating device list")
-        self._device_selector.clear()
         device_list = self.daq.list_available_devices()
-        self._device_selector.addItem("rescan")
-        self._device_selector.addItems(device_list)
+        # repopulate in one go, without emitting intermediate signals
+        self._device_selector.blockSignals(True)
+        self._device_selector.clear()
+        self._device_selector.addItems(["rescan", *device_list])
+        self._device_selector.blockSignals(False)
 
     def _set_device(self, *args):
         '''open a device'''
@@ -59,34 +64,42 @@ class DAQSelector(QGroupBox):
         else:
             self._logger.info(f"setting device to {device}")
             self.daq.set_device(device)
+            self.sig_channel_changed.emit(False)
             self._channel_selector.setEnabled(True)
             self._update_channel_list()
 
-    def _update_channel_list(self):
+    def _update_channel_list(self, rescan: bool = False):
         '''update the channel drop-down selector'''
         self._logger.debug("updating channel list")
+        device_list = self.daq.list_analog_input_channels(force=rescan)
+        # repopulate in one go, without emitting intermediate signals
+        self._channel_selector.blockSignals(True)
         self._channel_selector.clear()
-        device_list = self.daq.list_analog_input_channels()
-        self._channel_selector.addItem("rescan")
-        self._channel_selector.addItems(device_list)
+        self._channel_selector.addItems(["rescan", *device_list])
+        self._channel_selector.blockSignals(False)
 
     def _set_channel(self, *args):
         channel = self._channel_selector.currentText()
 
         if channel.casefold() == "rescan":
-            self._update_channel_list()
+            self._update_channel_list(rescan=True)
         else:
             self._logger.info(f"setting axis to {channel}")
             self.daq.set_channel(channel.rsplit('/', - 1)[-1])
+            self.sig_channel_changed.emit(self.daq.channel is not None)
 
 
 class DAQMonitor(QGroupBox):
-    def __init__(self, parent: QWidget | None = None, daq: DAQ | None = None) -> None:
+    def __init__(self, parent: QWidget | None = None, daq: DAQ | None = None,
+                 polled: bool = False) -> None:
         super().__init__("Channel Info", parent)
         self._logger = logging.getLogger(self.__class__.__name__)
 
         self._daq = daq or DAQ()
 
+        self._polled = polled
+        '''whether the DAQ is already read elsewhere, e.g. by a LiveValuePoller'''
+
         self._layout = QFormLayout(self)
 
         self._channel_voltage = QLabel(" - ", self)
@@ -95,11 +108,11 @@ class DAQMonitor(QGroupBox):
         # initally disabled bc no channel is connected
         self.setEnabled(False)
 
-        # data refresh
+        # data refresh. only runs while a channel is set
         self._refresh_timer = QTimer(self)
         self._refresh_timer.setInterval(500)
         self._refresh_timer.timeout.connect(self._update_channel_info)
-        self._refresh_timer.start()
+        self.set_channel_present(self.daq.channel is not None)
 
     @property
     def daq(self) -> DAQ:
@@ -110,6 +123,15 @@ class DAQMonitor(QGroupBox):
         self._refresh_timer.stop()
         return super().close()
 
+    def set_channel_present(self, present: bool):
+        '''start or stop monitoring, depending on whether a channel is set'''
+        self.setEnabled(present)
+        if present:
+            self._refresh_timer.start()
+        else:
+            self._refresh_timer.stop()
+            self._channel_voltage.setText(" - ")
+
     def _update_channel_info(self, *args):
         '''update the information pertaining to the given channel'''
         # self._logger.debug("updating channel info")
@@ -118,5 +140,9 @@ class DAQMonitor(QGroupBox):
         self.setEnabled(channel_present)
 
         if channel_present:
-            voltage = self.daq.read_channel()
+            if self._polled:
+                # someone else reads the DAQ, so reuse the latest reading
+                voltage = self.daq.last_value
+            else:
+                voltage = self.daq.read_channel()
             self._channel_voltage.setText(f"{voltage:.2f} V")
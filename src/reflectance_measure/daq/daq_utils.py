@@ -1,18 +1,33 @@
 import logging
+import threading
 
 from nidaqmx import Task
+from nidaqmx.constants import AcquisitionType, OverwriteMode, ReadRelativeTo
 from nidaqmx.system import System, Device, PhysicalChannel
 
 
 class DAQ:
+    SAMPLE_RATE: float = 1000.
+    '''rate [Hz] at which the channel is sampled in the background'''
+    READ_CHUNK: float = 0.5
+    '''longest time [s] `read_n` blocks in one read, between cancel checks'''
+
     def __init__(self) -> None:
         self._logger = logging.getLogger(self.__class__.__name__)
 
         self._task: Task | None = None
+        self._task_lock = threading.Lock()
+        '''the task is read from both the GUI and the measurement thread'''
+
+        self.last_value: float = float('nan')
+        '''the most recently read channel value'''
 
         self._device: Device | None = None
         self._channel: PhysicalChannel | None = None
 
+        self._chan_cache: dict[str, list[str]] = dict()
+        '''analog input channel names, per device name'''
+
     @property
     def task(self) -> Task | None:
         '''the currently running task'''
@@ -32,18 +47,26 @@ class DAQ:
     def set_device(self, device_name: str):
         '''set the device (expects sth like `Dev1`)'''
         # close old task
-        if self._task is not None:
-            self._task.close()
-            self._task = None
+        with self._task_lock:
+            if self._task is not None:
+                self._task.close()
+                self._task = None
         self._channel = None
 
         self._device = Device(device_name)
 
-    def list_analog_input_channels(self) -> list[str]:
-        '''list all analog input channels on the current device'''
+    def list_analog_input_channels(self, force: bool = False) -> list[str]:
+        '''
+        list all analog input channels on the current device.
+        the list is cached per device, use `force` to query it again.
+        '''
         if self._device is None:
             raise ConnectionError("Cannot connect to the device")
-        return list(c.name for c in self._device.ai_physical_chans)
+        name = self._device.name
+        if force or name not in self._chan_cache:
+            self._chan_cache[name] = list(
+                c.name for c in self._device.ai_physical_chans)
+        return self._chan_cache[name]
 
     @property
     def channel(self) -> PhysicalChannel | None:
@@ -61,31 +84,88 @@ class DAQ:
 
         self._channel = self.device.ai_physical_chans[channel_name]
 
-        # close old task
-        if self._task is not None:
-            self._task.close()
-        self._task = Task()
-
-        # add the new channel
-        self._task.ai_channels.add_ai_voltage_chan(
-            self._channel.name,
-            min_val=-10,
-            max_val=10
+        with self._task_lock:
+            # close old task
+            if self._task is not None:
+                self._task.close()
+            self._task = Task()
+
+            # add the new channel
+            self._task.ai_channels.add_ai_voltage_chan(
+                self._channel.name,
+                min_val=-10,
+                max_val=10
+            )
+
+            self._start_continuous()
+
+    def _start_continuous(self):
+        '''keep the task sampling in the background, and read the newest sample'''
+        self._task.timing.cfg_samp_clk_timing(
+            self.SAMPLE_RATE,
+            sample_mode=AcquisitionType.CONTINUOUS,
+            samps_per_chan=int(self.SAMPLE_RATE)
         )
-
-        # self.task.start()
+        # only the newest sample matters, so let the buffer wrap around
+        # instead of erroring out when it is not read for a while
+        self._task.in_stream.over_write = OverwriteMode.OVERWRITE_UNREAD_SAMPLES
+        self._task.in_stream.relative_to = ReadRelativeTo.MOST_RECENT_SAMPLE
+        self._task.in_stream.offset = -1
+        self._task.start()
 
     def read_channel(self) -> float:
-        if self.task is None:
-            raise RuntimeError("No channel set")
-        return self.task.read(timeout=.1)
+        with self._task_lock:
+            if self.task is None:
+                raise RuntimeError("No channel set")
+            self.last_value = self.task.read(timeout=.1)
+        return self.last_value
+
+    def read_n(self, n: int, rate: float,
+               cancel: threading.Event | None = None) -> list[float]:
+        '''
+        read `n` samples at `rate` Hz, using a hardware-timed
+        finite acquisition. the task goes back to continuous
+        background sampling afterwards.
+        the samples are read in chunks, and if `cancel` gets set, the
+        acquisition is stopped early and the samples read so far returned.
+        '''
+        chunk = max(1, int(rate*self.READ_CHUNK))
+        with self._task_lock:
+            if self.task is None:
+                raise RuntimeError("No channel set")
+            self.task.stop()
+            self.task.in_stream.over_write = OverwriteMode.DO_NOT_OVERWRITE_UNREAD_SAMPLES
+            self.task.in_stream.relative_to = ReadRelativeTo.CURRENT_READ_POSITION
+            self.task.in_stream.offset = 0
+            self.task.timing.cfg_samp_clk_timing(
+                rate,
+                sample_mode=AcquisitionType.FINITE,
+                samps_per_chan=n
+            )
+            values = []
+            try:
+                # start explicitly, or each read would restart the acquisition
+                self.task.start()
+                while len(values) < n:
+                    if cancel is not None and cancel.is_set():
+                        break
+                    m = min(chunk, n - len(values))
+                    values += self.task.read(number_of_samples_per_channel=m,
+                                             timeout=m/rate + 1)
+            finally:
+                self.task.stop()
+                self._start_continuous()
+            if len(values):
+                self.last_value = values[-1]
+        return values
 
     def close(self):
         '''gracefully shut down the connection to the current device'''
         self._logger.debug("closing DAQ")
-        if self._task is not None:
-            self._task.close()
-            self._task = None
+        with self._task_lock:
+            if self._task is not None:
+                self._task.close()
+                self._task = None
 
     def __enter__(self):
         '''context manager to make sure connection is properly closed'''
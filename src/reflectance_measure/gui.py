@@ -1,29 +1,40 @@
-import csv
+import os
 import math
 import time
+import bisect
+import shutil
 import logging
 from collections import deque
 from typing import TYPE_CHECKING
 
+import numpy as np
 import pyqtgraph as pg
 if TYPE_CHECKING:  # use the PyQt6 stubs for typechecking, as they
     # are the most complete
-    from PyQt6.QtCore import Qt, QTimer, QRectF
-    from PyQt6.QtGui import QKeySequence, QAction
+    from PyQt6.QtCore import (Qt, QObject, QThread, QTimer, QRectF, QPointF,
+                              pyqtSignal as Signal)
+    from PyQt6.QtGui import (QKeySequence, QAction, QGuiApplication,
+                             QPainter, QPicture, QPen)
     from PyQt6.QtWidgets import (QWidget, QMainWindow, QTabWidget,
                                  QBoxLayout, QDockWidget, QFileDialog)
 else:
-    from pyqtgraph.Qt.QtCore import Qt, QTimer, QRectF
-    from pyqtgraph.Qt.QtGui import QKeySequence, QAction
+    from pyqtgraph.Qt.QtCore import (Qt, QObject, QThread, QTimer, QRectF,
+                                     QPointF, Signal)
+    from pyqtgraph.Qt.QtGui import (QKeySequence, QAction, QGuiApplication,
+                                    QPainter, QPicture, QPen)
     from pyqtgraph.Qt.QtWidgets import (QWidget, QMainWindow, QTabWidget,
                                         QBoxLayout, QDockWidget, QFileDialog)
 
-from reflectance_measure.stage.stage_gui import (Stage, StageSelector,
-                                                 StageMonitor, StageControl)
+from reflectance_measure.stage.stage_gui import (Stage, StagePoller,
+                                                 StageSelector, StageMonitor,
+                                                 StageControl)
 from reflectance_measure.daq.daq_gui import DAQ, DAQSelector, DAQMonitor
 from reflectance_measure.automation import ExperimentAutomationWidget
 
 
+_DEG2RAD = math.pi / 180.
+
+
 class DynamicLayoutDockWidget(QDockWidget):
     '''
     dockwidget which dynamically adapts its layout depending
@@ -45,13 +56,94 @@ class DynamicLayoutDockWidget(QDockWidget):
             layout.setDirection(QBoxLayout.Direction.LeftToRight)
 
 
+class PolarGrid(pg.GraphicsObject):
+    '''
+    static polar grid (concentric circles and the two axes),
+    recorded once into a QPicture and drawn as a single item
+    '''
+
+    def __init__(self, radii: list[float], pen: QPen) -> None:
+        super().__init__()
+        r_max = max(radii)
+        self._bounds = QRectF(-r_max, -r_max, 2*r_max, 2*r_max)
+
+        self._picture = QPicture()
+        painter = QPainter(self._picture)
+        painter.setPen(pen)
+        painter.drawLine(QPointF(-r_max, 0), QPointF(r_max, 0))
+        painter.drawLine(QPointF(0, -r_max), QPointF(0, r_max))
+        for r in radii:
+            painter.drawEllipse(QPointF(0, 0), r, r)
+        painter.end()
+
+    def paint(self, painter: QPainter, *args):
+        painter.drawPicture(0, 0, self._picture)
+
+    def boundingRect(self) -> QRectF:
+        return self._bounds
+
+
+class LiveValuePoller(QObject):
+    '''
+    polls the DAQ value on its own thread, so a slow driver call never
+    blocks the GUI. the stage angle comes from the shared `StagePoller`.
+    emits `sig_sample(t, v)`, with `nan` if no channel is connected.
+    '''
+    sig_sample = Signal(float, float)
+
+    def __init__(self, daq: DAQ, interval: int = 100) -> None:
+        super().__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._daq = daq
+        self._interval = interval
+        self._timer: QTimer | None = None
+
+        self.experiment_running = False
+        '''while set, reuse the measurement thread's DAQ readings'''
+
+    def start(self):
+        '''start polling. must run on the poller's own thread'''
+        if self._timer is None:
+            self._timer = QTimer(self)
+            self._timer.setInterval(self._interval)
+            self._timer.timeout.connect(self._poll)
+        self._timer.start()
+
+    def stop(self):
+        '''stop polling. must run on the poller's own thread'''
+        if self._timer is not None:
+            self._timer.stop()
+
+    def _poll(self):
+        daq = self._daq
+        v = float('nan')
+        try:
+            if daq.channel is not None:
+                if self.experiment_running:
+                    # the measurement thread is reading the DAQ, don't compete
+                    v = daq.last_value
+                else:
+                    v = daq.read_channel()
+        except Exception as e:
+            self._logger.warning(
+                "polling failed. %s : %s", e.__class__.__name__, e)
+        self.sig_sample.emit(time.monotonic(), v)
+
+
 class MyMainWindow(QMainWindow):
     def __init__(self, parent: QWidget | None = None) -> None:
         super().__init__(parent)
+        self._logger = logging.getLogger(self.__class__.__name__)
 
         self._stage = Stage()
         self._daq = DAQ()
-        self._points: list[tuple(float, float)] = list()
+
+        # running per-angle averages, updated as points come in
+        self._avg_sum: dict[float, float] = dict()
+        self._avg_cnt: dict[float, int] = dict()
+        self._avg_angles: list[float] = list()
+        self._avg_means: list[float] = list()
 
         # scatterplot as central widget
         self._plot = pg.PlotWidget(self)
@@ -61,20 +153,45 @@ class MyMainWindow(QMainWindow):
         self._plot.setMinimumWidth(300)
 
         self._timeline_plot = pg.PlotWidget(self)
-        self._timeline = deque(maxlen=500), deque(maxlen=500)
+        self._timeline_plot.setDownsampling(auto=True, mode='peak')
+        self._timeline_plot.setClipToView(True)
+        self._timeline_curve = self._timeline_plot.plot([], [])
+
+        # timeline ring buffer. every sample is written twice, `_timeline_len`
+        # apart, so the latest samples are always one contiguous slice
+        self._timeline_len = 500
+        self._timeline = (np.zeros(2*self._timeline_len),
+                          np.zeros(2*self._timeline_len))
+        self._timeline_idx = 0
+        self._timeline_cnt = 0
+        self._timeline_dirty = False
+
+        # pens & brushes are built once, and shared between items
+        self._grid_pen = pg.mkPen(0.2)
+        self._point_pen = pg.mkPen(pg.getConfigOption('foreground'))
+        self._point_brush = pg.mkBrush(100, 100, 150)
 
         # polar grid lines
-        self._plot.addLine(x=0, pen=0.2)
-        self._plot.addLine(y=0, pen=0.2)
-        for r in range(1, 10, 1):
-            circle = pg.CircleROI((-r, -r), radius=r,
-                                  movable=False, handlePen=0.0)
-            circle.setPen(pg.mkPen(0.2))
-            self._plot.addItem(circle)
-
-        self._scatter = pg.ScatterPlotItem()
+        self._plot.addItem(PolarGrid(list(range(1, 10, 1)), self._grid_pen))
+
+        self._scatter = pg.ScatterPlotItem(pen=self._point_pen,
+                                           brush=self._point_brush)
         self._plot.addItem(self._scatter)
 
+        # measured points (angle, value) and their scatter coordinates,
+        # in buffers which double when full. new points are coalesced,
+        # and converted & flushed to the plot in batches
+        self._as = np.empty(1024)
+        self._vs = np.empty(1024)
+        self._xs = np.empty(1024)
+        self._ys = np.empty(1024)
+        self._n = 0
+        self._nb_pending = 0
+        self._scatter_timer = QTimer(self)
+        self._scatter_timer.setSingleShot(True)
+        self._scatter_timer.setInterval(50)
+        self._scatter_timer.timeout.connect(self._flush_scatter)
+
         self._avg = pg.PlotCurveItem(pen=pg.mkPen('red'))
         self._plot.addItem(self._avg)
 
@@ -84,10 +201,16 @@ class MyMainWindow(QMainWindow):
         self._photodiode_value = pg.ScatterPlotItem(brush=pg.mkBrush('red'))
         self._plot.addItem(self._photodiode_value)
 
+        # last drawn motor angle & photodiode value, to skip no-op redraws
+        self._last_a: float | None = None
+        self._last_v: float | None = None
+
         self._tabs = QTabWidget(self)
         self._tabs.addTab(self._plot, "polar plot")
         self._tabs.addTab(self._timeline_plot, "timeline")
         self._tabs.setCurrentIndex(0)
+        # only the visible plot is kept up to date
+        self._tabs.currentChanged.connect(self._update_current_value)
 
         self.setCentralWidget(self._tabs)
 
@@ -99,23 +222,22 @@ class MyMainWindow(QMainWindow):
         self._avg_action.triggered.connect(self.calculate_averages)
         self.tb.addAction(self._avg_action)
 
-        self._measure_action = QAction("measure", self)
-        self._measure_action.setShortcut(QKeySequence('Ctrl+M'))
-        self._measure_action.triggered.connect(self.measure_single_point)
-        self.tb.addAction(self._measure_action)
-
-        self._clear_action = QAction("clear", self)
-        self._clear_action.setShortcut(QKeySequence('Ctrl+R'))
-        self._clear_action.triggered.connect(self.clear)
-        self.tb.addAction(self._clear_action)
-
-        self._save_action = QAction("save", self)
-        self._save_action.setShortcut(QKeySequence('Ctrl+S'))
-        self._save_action.triggered.connect(self.save_to_file)
-        self.tb.addAction(self._save_action)
+        self._measure_action, self._clear_action, self._save_action = (
+            self._add_shortcut_action(text, shortcut, slot)
+            for text, shortcut, slot in (
+                ("measure", 'Ctrl+M', self.measure_single_point),
+                ("clear", 'Ctrl+R', self.clear),
+                ("save", 'Ctrl+S', self.save_to_file),
+            )
+        )
 
-        # add stage control widgets on the left
-        self._stage_info = StageMonitor(self, self._stage)
+        # add stage control widgets on the left. they share a single
+        # poller, so each state query serves all of them, as well as the
+        # current angle drawn in the plots
+        self._stage_poller = StagePoller(self._stage, self, interval=100)
+        self._stage_poller.sig_position.connect(self._on_stage_position)
+        self._stage_poller.sig_axis_present.connect(self._on_axis_present)
+        self._stage_info = StageMonitor(self, poller=self._stage_poller)
         self._stage_info_dock = QDockWidget(
             "stage info", self)
         self._stage_info_dock.setWidget(self._stage_info)
@@ -129,7 +251,7 @@ class MyMainWindow(QMainWindow):
         self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea,
                            self._stage_selector_dock)
 
-        self._stage_control = StageControl(self, self._stage)
+        self._stage_control = StageControl(self, poller=self._stage_poller)
         self._stage_control_dock = QDockWidget(
             "stage control", self)
         self._stage_control_dock.setWidget(self._stage_control)
@@ -138,9 +260,10 @@ class MyMainWindow(QMainWindow):
 
         self.tabifyDockWidget(self._stage_control_dock,
                               self._stage_selector_dock)
+        self._stage_poller.start()
 
         # add photodiode control widgets on the right
-        self._daq_info = DAQMonitor(self, self._daq)
+        self._daq_info = DAQMonitor(self, self._daq, polled=True)
         self._daq_info_dock = QDockWidget(
             "daq info", self)
         self._daq_info_dock.setWidget(self._daq_info)
@@ -153,44 +276,138 @@ class MyMainWindow(QMainWindow):
         self._daq_selector_dock.setWidget(self._daq_selector)
         self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea,
                            self._daq_selector_dock)
+        self._daq_selector.sig_channel_changed.connect(
+            self._daq_info.set_channel_present)
 
         # add automation widget on the bottom
         self._automation_widget = ExperimentAutomationWidget(
             self, stage=self._stage, daq=self._daq)
         self._automation_widget.sig_measurement_added.connect(
             self.add_single_point)
+        self._automation_widget.sig_experiment_started.connect(
+            self._experiment_started)
+        self._automation_widget.sig_experiment_finished.connect(
+            self._experiment_finished)
+        self._experiment_first_point: int | None = None
         self._automation_widget_dock = DynamicLayoutDockWidget(
             "automation", self)
         self._automation_widget_dock.setWidget(self._automation_widget)
         self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea,
                            self._automation_widget_dock)
 
+        # the refresh interval adapts to how long an update takes, so a
+        # slow update doesn't make the event queue pile up
+        self._refresh_period = 100.
+        screen = QGuiApplication.primaryScreen()
+        self._min_refresh_period = 1000. / (screen.refreshRate()
+                                            if screen else 60.)
+        self._refresh_delays: deque[float] = deque(maxlen=10)
         self._refresh_timer = QTimer(self)
-        self._refresh_timer.setInterval(100)
-        self._refresh_timer.timeout.connect(self._update_current_value)
+        self._refresh_timer.setInterval(int(self._refresh_period))
+        self._refresh_timer.timeout.connect(self._refresh)
         self._refresh_timer.start()
 
+        # the DAQ is polled on a separate thread, and the GUI only ever
+        # draws the latest sample
+        self._latest_v = float('nan')
+        self._latest_a = float('nan')
+        self._poller_thread = QThread(self)
+        self._poller = LiveValuePoller(self._daq)
+        self._poller.moveToThread(self._poller_thread)
+        self._poller.sig_sample.connect(self._on_sample)
+        self._poller_thread.started.connect(self._poller.start)
+        self._poller_thread.finished.connect(self._poller.stop)
+        self._poller_thread.start()
+
+    def _add_shortcut_action(self, text: str, shortcut: str, slot) -> QAction:
+        '''add an action with a keyboard shortcut to the toolbar'''
+        action = QAction(text, self)
+        action.setShortcut(QKeySequence(shortcut))
+        action.triggered.connect(slot)
+        self.tb.addAction(action)
+        return action
+
+    def _refresh(self):
+        '''run the periodic update, and adapt the timer to its duration'''
+        start = time.perf_counter()
+        self._update_current_value()
+        self._refresh_delays.append(1000*(time.perf_counter() - start))
+
+        delay = sum(self._refresh_delays) / len(self._refresh_delays)
+        self._refresh_timer.setInterval(int(max(
+            self._refresh_period - delay, self._min_refresh_period)))
+
+    def _on_stage_position(self, position: float):
+        '''store the angle from the stage poller, already sign-corrected'''
+        self._latest_a = position
+
+    def _on_axis_present(self, present: bool):
+        if not present:
+            self._latest_a = float('nan')
+
+    def showEvent(self, event) -> None:
+        # the current angle is drawn in this window, keep the stage polled
+        self._stage_poller.set_watched(self, True)
+        return super().showEvent(event)
+
+    def hideEvent(self, event) -> None:
+        # also received when the window is minimized
+        self._stage_poller.set_watched(self, False)
+        return super().hideEvent(event)
+
+    def _experiment_started(self):
+        self._poller.experiment_running = True
+        self._experiment_first_point = self._n
+
+    def _experiment_finished(self):
+        self._poller.experiment_running = False
+
+    def _on_sample(self, t: float, v: float):
+        '''store a sample from the poller, to be drawn on the next refresh'''
+        self._latest_v = v
+
+        # without a value there is nothing to add to the timeline
+        if math.isnan(v):
+            return
+        n, i = self._timeline_len, self._timeline_idx
+        t_buf, v_buf = self._timeline
+        t_buf[i] = t_buf[i + n] = t
+        v_buf[i] = v_buf[i + n] = v
+        self._timeline_idx = (i + 1) % n
+        self._timeline_cnt = min(self._timeline_cnt + 1, n)
+        self._timeline_dirty = True
+
     def _update_current_value(self, *args):
 
-        if self._daq.channel:
-            v = self._daq.read_channel()
-        else:
-            v = float('nan')
-        self._timeline[0].append(time.time())
-        self._timeline[1].append(v)
-        self._timeline_plot.plotItem.plot(
-            *self._timeline,
-            clear=True
-        )
+        # hidden plots are not updated. the timeline stays dirty until shown,
+        # and the polar items are compared against what was last drawn
+        current_plot = self._tabs.currentWidget()
+        if current_plot is self._timeline_plot:
+            if self._timeline_dirty:
+                self._timeline_dirty = False
+                n, i = self._timeline_len, self._timeline_idx - 1
+                t_buf, v_buf = self._timeline
+                view = slice(i + n + 1 - self._timeline_cnt, i + n + 1)
+                self._timeline_curve.setData(t_buf[view], v_buf[view])
+            return
+
+        v, a = self._latest_v, self._latest_a
+        if math.isnan(a):
+            return
 
-        if self._stage.axis:
-            a = -self._stage.get_position()
+        last_a, last_v = self._last_a, self._last_v
+        a_moved = last_a is None or abs(a - last_a) > 1e-2
+        if a_moved:
             self._motor_angle_line.setAngle(a)
+            self._last_a = a
 
-        if self._daq.channel and self._stage.axis:
-            a *= (math.pi/180)
-            x, y = v*math.cos(a), v*math.sin(a)
-            self._photodiode_value.setData([x], [y])
+        if not math.isnan(v):
+            v_moved = last_v is None or not abs(v - last_v) <= 1e-3
+            if a_moved or v_moved:
+                self._last_v = v
+                a *= _DEG2RAD
+                x, y = v*math.cos(a), v*math.sin(a)
+                self._photodiode_value.setData([x], [y])
 
     def save_to_file(self, *args):
         filename, _ = QFileDialog.getSaveFileName(
@@ -204,11 +421,28 @@ class MyMainWindow(QMainWindow):
         if not filename.lower().endswith(".csv"):
             filename += ".csv"
 
-        with open(filename, 'w') as file:
+        # if the points are exactly those the last automated run streamed
+        # to disk, just copy that file instead of serializing them again
+        automation = self._automation_widget.automation
+        streamed = automation.current_save_path
+        if (streamed is not None
+                and automation.stream_complete
+                and not self._automation_widget.running
+                and self._experiment_first_point == 0
+                and self._n == len(automation.measurements)):
+            if os.path.abspath(streamed) != os.path.abspath(filename):
+                shutil.copyfile(streamed, filename)
+            return
 
-            writer = csv.writer(file, lineterminator='\n')
-            writer.writerow(["angle [deg]", "intensity [V]"])
-            writer.writerows(self._points)
+        # np.savetxt writes row by row, so give it a large buffer
+        with open(filename, 'w', newline='', buffering=1 << 16) as file:
+            np.savetxt(file,
+                       np.column_stack((self._as[:self._n],
+                                        self._vs[:self._n])),
+                       fmt='%.6g',
+                       delimiter=',',
+                       header="angle [deg],intensity [V]",
+                       comments='')
 
     def measure_single_point(self, *args):
         print("measure")
@@ -217,51 +451,121 @@ class MyMainWindow(QMainWindow):
         self.add_single_point((a, v))
 
     def add_single_point(self, point: tuple[float, float]):
-        self._points.append(point)
-        a, v = point
-        a *= (math.pi/180)
-        self._scatter.addPoints([math.cos(a)*v], [math.sin(a)*v])
+        if self._n == self._as.size:
+            size = 2*self._as.size
+            self._as = np.resize(self._as, size)
+            self._vs = np.resize(self._vs, size)
+            self._xs = np.resize(self._xs, size)
+            self._ys = np.resize(self._ys, size)
+        self._as[self._n], self._vs[self._n] = point
+        self._n += 1
+        self._nb_pending += 1
+        if self._nb_pending >= 16:
+            self._flush_scatter()
+        elif not self._scatter_timer.isActive():
+            self._scatter_timer.start()
+        self._update_average(*point)
         if self._avg_action.isChecked():
             self.calculate_averages()
 
+    def _flush_scatter(self):
+        '''add all pending points to the scatter plot in one go'''
+        self._scatter_timer.stop()
+        if not self._nb_pending:
+            return
+        new = slice(self._n - self._nb_pending, self._n)
+        rad = np.deg2rad(self._as[new])
+        np.multiply(np.cos(rad), self._vs[new], out=self._xs[new])
+        np.multiply(np.sin(rad), self._vs[new], out=self._ys[new])
+        self._scatter.setData(
+            self._xs[:self._n],
+            self._ys[:self._n],
+            pen=self._point_pen,
+            brush=self._point_brush
+        )
+        self._nb_pending = 0
+
+    def _update_average(self, a: float, v: float):
+        '''fold a new point into the running per-angle averages'''
+        if a in self._avg_cnt:
+            self._avg_sum[a] += v
+            self._avg_cnt[a] += 1
+            i = bisect.bisect_left(self._avg_angles, a)
+            self._avg_means[i] = self._avg_sum[a] / self._avg_cnt[a]
+        else:
+            self._avg_sum[a] = v
+            self._avg_cnt[a] = 1
+            i = bisect.bisect_left(self._avg_angles, a)
+            self._avg_angles.insert(i, a)
+            self._avg_means.insert(i, v)
+
     def calculate_averages(self, enabled=True):
         if not enabled:
             self._avg.clear()
             self._plot.plotItem.replot()
             return
 
-        avg_x, avg_y = [], []
-        unique_a = sorted(set(tuple(zip(*self._points))[0]))
-        for a_a in unique_a:
-            v_a = [v for a, v in self._points if a == a_a]
-            avg_v = sum(v_a)/len(v_a)
-            a_a *= (math.pi/180)
-            avg_x.append(math.cos(a_a)*avg_v)
-            avg_y.append(math.sin(a_a)*avg_v)
-
-        self._avg.setData(avg_x, avg_y)
+        r = np.deg2rad(self._avg_angles)
+        means = np.asarray(self._avg_means)
+        xs, ys = np.cos(r), np.sin(r)
+        xs *= means
+        ys *= means
+        self._avg.setData(xs, ys)
 
     def clear(self):
-        self._scatter.clear()
+        self._scatter_timer.stop()
+        self._n = 0
+        self._nb_pending = 0
+        self._scatter.setData(x=np.empty(0), y=np.empty(0))
         self._avg.clear()
-        self._points = list()
-        self._plot.plotItem.replot()
+        self._experiment_first_point = None
+        self._avg_sum.clear()
+        self._avg_cnt.clear()
+        self._avg_angles.clear()
+        self._avg_means.clear()
 
     def closeEvent(self, *args):
+        self._poller_thread.quit()
+        self._poller_thread.wait(2000)
+        # stop the stage polling thread before closing the stage
+        self._stage_poller.stop()
+        self._stage_info.close()
+        self._stage_control.close()
         try:
             self._stage.close()
-        except Exception as e:
-            print(e)
+        except Exception:
+            self._logger.exception("failed to close the stage")
         try:
             self._daq.close()
-        except Exception as e:
-            print(e)
+        except Exception:
+            self._logger.exception("failed to close the DAQ")
         return super().closeEvent(*args)
 
 
 if __name__ == "__main__":
     import sys
-    logging.basicConfig(level=logging.DEBUG)
+    import queue
+    import importlib.util
+    from logging.handlers import QueueHandler, QueueListener
+
+    # log records are written to stderr from a separate thread,
+    # so a slow console never stalls the GUI
+    log_queue = queue.Queue()
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    log_listener = QueueListener(log_queue, log_handler)
+    logging.basicConfig(level=logging.DEBUG,
+                        handlers=[QueueHandler(log_queue)])
+    log_listener.start()
+
+    if importlib.util.find_spec("OpenGL") is not None:
+        pg.setConfigOption('useOpenGL', True)
+        pg.setConfigOption('enableExperimental', True)
+    else:
+        logging.info(
+            "Plotting without OpenGL. "
+            "Please install PyOpenGL for faster plots ( pip install PyOpenGL )"
+        )
 
     app = pg.mkQApp("reflectance measure")
 
@@ -280,4 +584,6 @@ if __name__ == "__main__":
     mw = MyMainWindow()
     mw.show()
 
-    sys.exit(app.exec())
+    exit_code = app.exec()
+    log_listener.stop()
+    sys.exit(exit_code)
@@ -1,9 +1,20 @@
-import time
+import code
 
 from reflectance_measure.stage_old.stage_utils import Stage
 from reflectance_measure.daq.daq_utils import DAQ
 
 
+class Console(code.InteractiveConsole):
+    '''an interactive console which, like the old REPL, exits on Ctrl+C'''
+
+    def raw_input(self, prompt: str = "") -> str:
+        try:
+            return super().raw_input(prompt)
+        except KeyboardInterrupt:
+            self.write("\n")
+            raise EOFError  # ends `interact()`
+
+
 with DAQ() as daq, Stage() as stage:
     try:
         stage.interactive_setup()
@@ -18,11 +29,6 @@ with DAQ() as daq, Stage() as stage:
         print("skipping stage setup")
 
     # while stage.axis or daq.channel:
-    while True:
-        try:
-            exec(input(">>> "))
-        except KeyboardInterrupt:
-            break
-        except Exception as e:
-            print(e)
-        time.sleep(.1)
+    Console(locals=globals()).interact(
+        banner="`daq` and `stage` are set up. press Ctrl+C to exit.",
+        exitmsg="closing the DAQ and stage")
@@ -0,0 +1,87 @@
+import abc
+import time
+
+
+_PORTS_CACHE_TTL = 1.
+_ports_cache: tuple[float, list[str]] | None = None
+'''the last enumerated COM ports, and when they were enumerated'''
+
+
+class StageBase(abc.ABC):
+    '''
+    the parts common to all stage implementations: port discovery,
+    context management and the interactive command-line setup.
+    '''
+
+    @staticmethod
+    def list_available_ports() -> list[str]:
+        '''
+        return a list of all available COM ports on this PC.
+        enumerating the ports is slow, so the list is reused for a second.
+        '''
+        global _ports_cache
+        now = time.monotonic()
+        if _ports_cache is None or now - _ports_cache[0] >= _PORTS_CACHE_TTL:
+            from serial.tools.list_ports import comports
+            _ports_cache = (now, list(p.name for p in comports()))
+        return list(_ports_cache[1])
+
+    @abc.abstractmethod
+    def list_available_axes(self) -> list[str]:
+        '''return a list of all available axes'''
+
+    @abc.abstractmethod
+    def close(self):
+        '''gracefully shut down the connection to the current device'''
+
+    @abc.abstractmethod
+    def open_connection(self, port: str):
+        '''open the COM port on which the stage is located'''
+
+    @abc.abstractmethod
+    def set_axis(self, axis_number: int):
+        '''set the axis of the stage'''
+
+    def __enter__(self):
+        '''context manager to make sure connection is properly closed'''
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _interactive_setup_device(self):
+        '''interactively select anything needed between the port and the axis'''
+
+    def interactive_setup(self):
+        '''interactively set up a Stage object, using command-line prompts for input'''
+
+        # find out which COM port are available
+        print("The following COM ports have been detected : ")
+        ports = self.list_available_ports()
+        if len(ports):
+            print(*ports, sep='\n')
+        else:
+            raise RuntimeError(
+                "No COM ports detected -- make sure your device is connected and powered on")
+
+        # open connection to stage
+        port = input("which COM port would you like to use ? (int) ")
+        if not port.isnumeric():
+            raise TypeError("expected a COM port number")
+        self.open_connection(f"COM{port}")
+
+        self._interactive_setup_device()
+
+        # find out which axes are available
+        axes = self.list_available_axes()
+        if len(axes):
+            print(*axes, sep='\n')
+        else:
+            raise RuntimeError("No axes detected")
+
+        # open connection to axis
+        axis_number = input(
+            "which axis would you like to use ? (int) ")
+        if not axis_number.isnumeric():
+            raise TypeError("expected an axis number")
+        self.set_axis(int(axis_number))
@@ -1,21 +1,115 @@
 from typing import TYPE_CHECKING
 
 import logging
+import threading
 import pyqtgraph as pg
 if TYPE_CHECKING:  # use the PyQt6 stubs for typechecking, as they are the nicest
     try:
-        from PyQt6.QtCore import Qt, QTimer
+        from PyQt6.QtCore import Qt, QObject, QThread, pyqtSignal as Signal
         from PyQt6.QtWidgets import *
     except ImportError:
-        from PyQt5.QtCore import Qt, QTimer
+        from PyQt5.QtCore import Qt, QObject, QThread, pyqtSignal as Signal
         from PyQt5.QtWidgets import *
 else:
-    from pyqtgraph.Qt.QtCore import Qt, QTimer
+    from pyqtgraph.Qt.QtCore import Qt, QObject, QThread, Signal
     from pyqtgraph.Qt.QtWidgets import *
 
 from reflectance_measure.stage.stage_utils import Stage
 
 
+class StagePoller(QThread):
+    '''
+    polls the state of a Stage on a separate thread, so the serial
+    round-trips never block the GUI. the results are emitted as signals,
+    which are delivered to widgets through queued connections.
+    '''
+    sig_axis_present = Signal(bool)
+    sig_position = Signal(float)
+    sig_busy = Signal(bool)
+    sig_enabled = Signal(bool)
+    sig_error = Signal(int, str)
+
+    def __init__(self, stage: Stage, parent: QObject | None = None,
+                 interval: int = 500) -> None:
+        super().__init__(parent)
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._stage = stage
+        self._interval = interval
+
+        self._watchers: set[int] = set()
+        '''the visible widgets showing the polled values'''
+
+        self._wake = threading.Event()
+        '''set to cut the wait between two polls short'''
+
+        self._axis_present: bool | None = None
+        '''the last value emitted by sig_axis_present'''
+
+    @property
+    def stage(self) -> Stage:
+        '''the Stage instance polled by this thread'''
+        return self._stage
+
+    def set_watched(self, watcher: QObject, watched: bool):
+        '''
+        register whether a widget is currently showing the polled values.
+        the stage is only polled while at least one widget is watching.
+        '''
+        if watched:
+            self._watchers.add(id(watcher))
+            # let a newly shown widget receive the current state
+            self._axis_present = None
+        else:
+            self._watchers.discard(id(watcher))
+
+    def stop(self):
+        '''ask the polling loop to exit, and wait for it'''
+        self.requestInterruption()
+        self._wake.set()
+        self.wait()
+
+    def poll_now(self):
+        '''poll as soon as possible, e.g. after a command changed the stage state'''
+        self._wake.set()
+
+    def run(self):
+        while not self.isInterruptionRequested():
+            # clear before polling, so a wake request made during the poll
+            # is honoured by the next wait rather than lost
+            self._wake.clear()
+            if self._watchers:
+                self._poll()
+            self._wake.wait(self._interval / 1000)
+
+    def _poll(self):
+        if self.stage.axis is None:
+            self._set_axis_present(False)
+            return
+
+        try:
+            snapshot = self.stage.snapshot()
+        except Exception as e:
+            self._logger.warning(
+                "polling failed. %s : %s", e.__class__.__name__, e)
+            return
+
+        if snapshot.err_code != 0:
+            self.sig_error.emit(snapshot.err_code, snapshot.err_msg)
+        # axis is inverted --> add a '-' sign here
+        self.sig_position.emit(-snapshot.position)
+        self.sig_busy.emit(snapshot.busy)
+        self.sig_enabled.emit(snapshot.enabled)
+        # after sig_busy, so widgets are not re-enabled mid-motion
+        self._set_axis_present(True)
+
+    def _set_axis_present(self, axis_present: bool):
+        '''emit sig_axis_present, but only when the value changes'''
+        if axis_present != self._axis_present:
+            self._axis_present = axis_present
+            self.sig_axis_present.emit(axis_present)
+
+
 class StageSelector(QGroupBox):
 
     def __init__(self, parent: QWidget | None = None, stage: Stage | None = None) -> None:
@@ -26,6 +120,10 @@ class StageSelector(QGroupBox):
 
         self._layout = QFormLayout(self)
 
+        # the entries of the selectors, after the leading "rescan" item
+        self._ports: list[str] = []
+        self._axis_ids: list[int] = []
+
         self._connection_selector = QComboBox(self)
         self._connection_selector.activated.connect(self._open_connection)
         self._layout.addRow("Port :", self._connection_selector)
@@ -46,20 +144,21 @@ class StageSelector(QGroupBox):
     def _update_com_ports(self):
         '''update the connection drop-down selector'''
         self._logger.debug("updating COM ports")
+        ports = self._ports = self.stage.list_available_ports()
+        # repopulate in one go, without emitting intermediate signals
+        self._connection_selector.blockSignals(True)
         self._connection_selector.clear()
-        ports = self.stage.list_available_ports()
-        self._connection_selector.addItem("rescan")
-        self._connection_selector.addItems(ports)
+        self._connection_selector.addItems(["rescan", *ports])
+        self._connection_selector.blockSignals(False)
 
-    def _open_connection(self, *args):
+    def _open_connection(self, index: int):
         '''open a new connection'''
-        port = self._connection_selector.currentText()
-
-        if port.casefold() == "rescan":
+        if index == 0:  # "rescan"
             self._update_com_ports()
 
         else:
-            self._logger.info(f"opening connection to {port}")
+            port = self._ports[index - 1]
+            self._logger.info("opening connection to %s", port)
             self.stage.open_connection(port)
             self._axis_selector.setEnabled(True)
             self._update_axis_list()
@@ -67,30 +166,34 @@ class StageSelector(QGroupBox):
     def _update_axis_list(self):
         '''update the axis drop-down selector'''
         self._logger.debug("updating axes list")
-        self._axis_selector.clear()
         axis_list = self.stage.list_available_axes()
-        self._axis_selector.addItem("rescan")
-        self._axis_selector.addItems(axis_list)
+        self._axis_ids = [int(axis.split(':')[0]) for axis in axis_list]
+        # repopulate in one go, without emitting intermediate signals
+        self._axis_selector.blockSignals(True)
+        self._axis_selector.clear()
+        self._axis_selector.addItems(["rescan", *axis_list])
+        self._axis_selector.blockSignals(False)
 
-    def _open_axis(self, *args):
+    def _open_axis(self, index: int):
         '''open a device an the current connection'''
-
-        axis = self._axis_selector.currentText()
-
-        if axis.casefold() == "rescan":
+        if index == 0:  # "rescan"
             self._update_axis_list()
         else:
-            self._logger.info(f"setting axis to {axis}")
-            axis_number = int(axis.split(':')[0].strip())
+            axis_number = self._axis_ids[index - 1]
+            self._logger.info("setting axis to %s", axis_number)
             self.stage.set_axis(axis_number)
 
 
 class StageMonitor(QGroupBox):
-    def __init__(self, parent: QWidget | None = None, stage: Stage | None = None) -> None:
+    _BUSY_STR = 'busy'
+    _IDLE_STR = 'idle'
+
+    def __init__(self, parent: QWidget | None = None, stage: Stage | None = None,
+                 poller: StagePoller | None = None) -> None:
         super().__init__("Axis Info", parent)
         self._logger = logging.getLogger(self.__class__.__name__)
 
-        self._stage = stage or Stage()
+        self._stage = stage or (poller.stage if poller else Stage())
 
         self._layout = QFormLayout(self)
 
@@ -106,53 +209,71 @@ class StageMonitor(QGroupBox):
         self._axis_position = QLabel(" N/A ° ", self)
         self._layout.addRow("Position", self._axis_position)
 
+        # last displayed values, to skip redundant label updates
+        self._last_position: float | None = None
+        self._last_busy: bool | None = None
+
         # initally disabled bc no axis is connected
         self.setEnabled(False)
 
-        # data refresh
-        self._refresh_timer = QTimer(self)
-        self._refresh_timer.setInterval(500)
-        self._refresh_timer.timeout.connect(self._update_axis_info)
-        self._refresh_timer.start()
+        # data refresh, from a polling thread. a shared poller is owned,
+        # started and stopped by whoever created it
+        self._own_poller = poller is None
+        self._poller = poller or StagePoller(self._stage, self)
+        self._poller.sig_axis_present.connect(self.setEnabled)
+        self._poller.sig_error.connect(self._add_error)
+        self._poller.sig_position.connect(self._set_position)
+        self._poller.sig_busy.connect(self._set_busy)
+        if self._own_poller:
+            self._poller.start()
 
     def close(self) -> bool:
-        self._refresh_timer.stop()
+        if self._own_poller:
+            self._poller.stop()
         return super().close()
 
+    def showEvent(self, event) -> None:
+        self._poller.set_watched(self, True)
+        return super().showEvent(event)
+
+    def hideEvent(self, event) -> None:
+        # also received when the window is minimized
+        self._poller.set_watched(self, False)
+        return super().hideEvent(event)
+
     @property
     def stage(self) -> Stage:
         '''the Stage instance belonging to this widget'''
         return self._stage
 
-    def _update_axis_info(self, *args):
-        '''update the information pertaining to the given axis'''
-        # self._logger.debug("updating axis info")
-
-        axis_present = self.stage.axis is not None
-
-        self.setEnabled(axis_present)
+    def _add_error(self, err_code: int, err_msg: str):
+        self._error_log.addItem(err_msg)
+        self._error_log.scrollToBottom()
 
-        if axis_present:
-            err_code, err_msg = self.stage.error_status()
-            if err_code != 0:
-                self._error_log.addItem(err_msg)
-                self._error_log.scrollToBottom()
-
-            # axis is inverted --> add a '-' sign here
-            position = -self.stage.get_position()
+    def _set_position(self, position: float):
+        if position != self._last_position:
             self._axis_position.setText(f"{position}°")
+            self._last_position = position
 
-            busy = self.stage.is_busy()
-            self._axis_busy.setText('busy' if busy else 'idle')
+    def _set_busy(self, busy: bool):
+        if busy != self._last_busy:
+            self._axis_busy.setText(
+                self._BUSY_STR if busy else self._IDLE_STR)
+            self._last_busy = busy
 
 
 class StageControl(QGroupBox):
+    _MOVE_FMT = "Move to %d°"
+    _ERR_NO_AXIS_HOME = "Cannot home. No axis set"
+    _ERR_NO_AXIS_MOVE = "Cannot move. No axis set"
+    _ERR_NO_AXIS_STOP = "Cannot stop. No axis set"
 
-    def __init__(self, parent: QWidget | None = None, stage: Stage | None = None) -> None:
+    def __init__(self, parent: QWidget | None = None, stage: Stage | None = None,
+                 poller: StagePoller | None = None) -> None:
         super().__init__("Axis Control", parent)
         self._logger = logging.getLogger(self.__class__.__name__)
 
-        self._stage = stage or Stage()
+        self._stage = stage or (poller.stage if poller else Stage())
 
         self._layout = QFormLayout(self)
 
@@ -180,63 +301,82 @@ class StageControl(QGroupBox):
         self._layout.addRow("", self._axis_stop_btn)
         self._axis_stop_btn.setDisabled(True)
 
-        self._axis_target_slider.valueChanged.connect(
-            lambda v: self._axis_move_btn.setText(f"Move to {v}°"))
+        self._axis_target_slider.valueChanged.connect(self._set_target)
 
         # initally disabled bc no axis is connected
         self.setEnabled(False)
 
-        # data refresh
-        self._refresh_timer = QTimer(self)
-        self._refresh_timer.setInterval(500)
-        self._refresh_timer.timeout.connect(self._update_axis_info)
-        self._refresh_timer.start()
+        # last displayed state, to skip redundant widget updates
+        self._last_busy: bool | None = None
+
+        # data refresh, from a polling thread. a shared poller is owned,
+        # started and stopped by whoever created it
+        self._own_poller = poller is None
+        self._poller = poller or StagePoller(self._stage, self)
+        self._poller.sig_axis_present.connect(self.setEnabled)
+        self._poller.sig_enabled.connect(self._set_enabled)
+        self._poller.sig_busy.connect(self._set_busy)
+        if self._own_poller:
+            self._poller.start()
 
         # error messages
         self._err_handler = QErrorMessage(self)
 
     def close(self) -> bool:
-        self._refresh_timer.stop()
+        if self._own_poller:
+            self._poller.stop()
         return super().close()
 
+    def showEvent(self, event) -> None:
+        self._poller.set_watched(self, True)
+        return super().showEvent(event)
+
+    def hideEvent(self, event) -> None:
+        # also received when the window is minimized
+        self._poller.set_watched(self, False)
+        return super().hideEvent(event)
+
     @property
     def stage(self) -> Stage:
         '''the Stage instance belonging to this widget'''
         return self._stage
 
-    def _update_axis_info(self, *args):
-        '''update the information pertaining to the given axis'''
-        # self._logger.debug("updating axis info")
-
-        axis_present = self.stage.axis is not None
+    def _set_target(self, target: int):
+        self._axis_move_btn.setText(self._MOVE_FMT % target)
 
-        self.setEnabled(axis_present)
+    def _set_enabled(self, enabled: bool):
+        # compare with the button itself, since clicking it toggles it
+        # before the stage has confirmed the change
+        if enabled != self._axis_enable_btn.isChecked():
+            self._axis_enable_btn.setChecked(enabled)
 
-        if axis_present:
-            self._axis_enable_btn.setChecked(self.stage.enabled())
-
-            busy = self.stage.is_busy()
-            self._axis_enable_btn.setDisabled(busy)
-            self._axis_home_btn.setDisabled(busy)
-            self._axis_move_btn.setDisabled(busy)
-            self._axis_stop_btn.setDisabled(not busy)
+    def _set_busy(self, busy: bool):
+        if busy == self._last_busy:
+            return
+        self._last_busy = busy
+        # repaint the buttons once, rather than once per button
+        self.setUpdatesEnabled(False)
+        self._axis_enable_btn.setDisabled(busy)
+        self._axis_home_btn.setDisabled(busy)
+        self._axis_move_btn.setDisabled(busy)
+        self._axis_stop_btn.setDisabled(not busy)
+        self.setUpdatesEnabled(True)
 
     def _home(self, *args):
         if self.stage.axis is None:
-            ermsg = "Cannot home. No axis set"
-            self._err_handler.showMessage(ermsg)
-            self._logger.error(ermsg)
+            self._err_handler.showMessage(self._ERR_NO_AXIS_HOME)
+            self._logger.error(self._ERR_NO_AXIS_HOME)
             return
 
         self._logger.debug("initiating homing procedure")
         self.stage.goto_home()
         self.setDisabled(True)
+        self._poller.poll_now()
 
     def _move(self, *args):
         if self.stage.axis is None:
-            ermsg = "Cannot move. No axis set"
-            self._err_handler.showMessage(ermsg)
-            self._logger.error(ermsg)
+            self._err_handler.showMessage(self._ERR_NO_AXIS_MOVE)
+            self._logger.error(self._ERR_NO_AXIS_MOVE)
             return
 
         self._logger.debug("initiating motion procedure")
@@ -246,15 +386,17 @@ class StageControl(QGroupBox):
         )
         self._axis_move_btn.setText("Move")
         self.setDisabled(True)
+        self._poller.poll_now()
 
     def _stop(self, *args):
         if self.stage.axis is None:
-            ermsg = "Cannot stop. No axis set"
-            self._err_handler.showMessage(ermsg)
-            self._logger.error(ermsg)
+            self._err_handler.showMessage(self._ERR_NO_AXIS_STOP)
+            self._logger.error(self._ERR_NO_AXIS_STOP)
             return
         self._logger.debug("stopping motion!")
         self.stage.stop()
+        self._poller.poll_now()
 
     def _enable_stage(self, enable: bool):
         self.stage.enable(enable)
+        self._poller.poll_now()
@@ -1,92 +1,231 @@
 import time
+import functools
 import typing
 import logging
+import threading
 
 from serial import Serial
-from serial.tools.list_ports import comports
 
+from reflectance_measure.stage.stage_base import StageBase
 
-class TimeStampedDict(dict):
+
+_EXPIRED = (None, 0)
+'''an empty or invalidated cache slot'''
+
+
+class _StageCache:
     '''
-    log the timestamp of when a dict item was set.
-    if the item was never set, return a `(None, 0)`
+    cached responses from the stage, one slot per cached query.
+    each slot holds a `(response, deadline)` pair, where the deadline is
+    a `time.monotonic_ns()` value. an empty slot is `_EXPIRED`.
     '''
+    __slots__ = ('mo', 'pa', 'ts', 'va')
 
-    def __setitem__(self, __key: typing.Any, __value: typing.Any) -> None:
-        return super().__setitem__(__key, (__value, time.time()))
+    def __init__(self) -> None:
+        self.mo = self.pa = self.ts = self.va = _EXPIRED
 
-    def __getitem__(self, __key: typing.Any) -> typing.Any:
-        try:
-            return super().__getitem__(__key)
-        except KeyError:
-            return (None, 0)
+
+class StageSnapshot(typing.NamedTuple):
+    '''the state of a stage axis, as read in a single exchange'''
+    position: float
+    busy: bool
+    enabled: bool
+    err_code: int
+    err_msg: str
+
+
+class _AxisCommands(typing.NamedTuple):
+    '''
+    the fixed commands for one axis, encoded once when the axis is set.
+    the `_fmt` commands are templates, to be %-formatted with a position.
+    '''
+    mo_q: bytes
+    pa_q: bytes
+    va_q: bytes
+    motor_on: bytes
+    motor_off: bytes
+    home: bytes
+    stop: bytes
+    snapshot: bytes
+    home_and_wait: bytes
+    pa_fmt: bytes
+    pa_and_wait_fmt: bytes
+    pa_checked_fmt: bytes
+
+    @classmethod
+    def for_axis(cls, n: int) -> '_AxisCommands':
+        return cls(*(f"{cmd}\r\n".encode("ascii") for cmd in (
+            f"{n}MO?", f"{n}PA?", f"{n}VA?", f"{n}MO", f"{n}MF",
+            f"{n}OR", f"{n}ST", f"TB;{n}PA?;TS;{n}MO?",
+            f"{n}MO;{n}OR;{n}WS0;TB", f"{n}PA%.4f", f"{n}PA%.4f;{n}WS0;TB",
+            f"{n}PA%.4f;TB")))
+
+
+def _require_conn(func: typing.Callable) -> typing.Callable:
+    '''
+    decorator for Stage methods which need an open connection and an axis.
+    raises RuntimeError if the connection is not set up correctly.
+    '''
+    @functools.wraps(func)
+    def _func(self: 'Stage', *args, **kwargs):
+        if not self._ready:
+            self.connection_check()
+        return func(self, *args, **kwargs)
+    return _func
 
 
 class ESP301_Connection(Serial):
-    def __init__(self, port: str | None = None, timeout: float = 0.1) -> None:
+    MAX_RESPONSE = 128
+    '''no response from the controller is longer than this'''
+
+    def __init__(self, port: str | None = None, timeout: float = 0.1,
+                 baudrate: int = 19200, rtscts: bool = True) -> None:
+        '''
+        `baudrate` must match the setting of the controller. it ships at
+        19200, and can be raised up to 115200 with the `BR` command.
+
+        the controller expects RTS/CTS handshaking. only disable `rtscts`
+        for cables which do not carry these lines.
+        '''
         super().__init__(port=port,
-                         baudrate=19200,
+                         baudrate=baudrate,
                          bytesize=8,
                          parity="N",
                          stopbits=1,
                          timeout=timeout,
                          write_timeout=timeout,
-                         rtscts=True
+                         rtscts=rtscts
                          )
-        self._locked: bool = False
+        self._lock = threading.Lock()
+        '''the stage is polled from several threads, keep exchanges atomic'''
+
+        self._rxbuf = bytearray()
+        '''received bytes which are not part of a returned response yet'''
 
     def command(self, command: str):
-        while (self._locked):
-            time.sleep(self.timeout)
-        self._locked = True
-        self.write(f"{command}\r\n".encode("ascii"))
-        self._locked = False
+        self.write_raw(f"{command}\r\n".encode("ascii"))
+
+    def write_raw(self, raw: bytes):
+        '''send an already encoded and terminated command'''
+        with self._lock:
+            self.write(raw)
 
     def response(self) -> bytes:
-        response = self.readline().removesuffix(b'\r\n')
+        with self._lock:
+            return self._read_response()
+
+    def _read_response(self, timeout: float | None = None) -> bytes:
+        '''
+        read one CRLF-terminated response, without its terminator.
+        whatever is already waiting is read in one go, and any bytes past
+        the terminator are kept for the next response. if no terminator
+        arrives before the timeout, the partial response is returned.
+        '''
+        rxbuf = self._rxbuf
+        end = rxbuf.find(b'\r\n')
+        deadline = time.monotonic() + \
+            (self.timeout if timeout is None else timeout)
+        while end < 0 and len(rxbuf) < self.MAX_RESPONSE \
+                and time.monotonic() < deadline:
+            rxbuf += self.read(self.in_waiting or 1)
+            end = rxbuf.find(b'\r\n')
+
+        if end < 0:
+            response = bytes(rxbuf)
+            rxbuf.clear()
+        else:
+            response = bytes(rxbuf[:end])
+            del rxbuf[:end + 2]
         return response
 
     def command_with_response(self, command: str) -> bytes:
-        while (self._locked):
-            time.sleep(self.timeout)
-        self._locked = True
-        self.write(f"{command}\r\n".encode("ascii"))
-        response = self.readline().removesuffix(b'\r\n')
-        self._locked = False
+        return self.query_raw(f"{command}\r\n".encode("ascii"))
+
+    def query_raw(self, raw: bytes, timeout: float | None = None) -> bytes:
+        '''send an already encoded and terminated query, and read the response'''
+        with self._lock:
+            self.write(raw)
+            response = self._read_response(timeout)
+        return response
+
+    def command_multi(self, commands: list[str]) -> list[bytes]:
+        '''
+        send several queries on a single line, and read back one
+        response per query. every command must produce a response.
+        '''
+        return self.query_multi_raw(
+            f"{';'.join(commands)}\r\n".encode("ascii"), len(commands))
+
+    def query_multi_raw(self, raw: bytes, count: int) -> list[bytes]:
+        '''send an already encoded line of `count` queries, and read the responses'''
+        with self._lock:
+            self.write(raw)
+            responses = [self._read_response() for _ in range(count)]
+        return responses
+
+    def query_or_abort_raw(self, raw: bytes, timeout: float,
+                           abort: bytes, abort_timeout: float) -> bytes:
+        '''
+        send an already encoded query, and read the response. if none
+        arrives within `timeout`, send `abort` and wait up to
+        `abort_timeout` for the late response, which is discarded. the
+        lock is held throughout, so no other query can receive it.
+        returns an empty response on timeout.
+        '''
+        with self._lock:
+            self.write(raw)
+            response = self._read_response(timeout)
+            if not response:
+                self.write(abort)
+                if not self._read_response(abort_timeout):
+                    # still nothing: drop whatever may arrive out of step
+                    self.reset_input_buffer()
+                    self._rxbuf.clear()
         return response
 
 
-class Stage:
-    def __init__(self, port: str | None = None, axis_number: int | None = None, cache_timeout=0.1) -> None:
+class Stage(StageBase):
+    STOP_TIMEOUT = 5.
+    '''time [s] allowed for the axis to decelerate after a stop'''
+
+    def __init__(self, port: str | None = None, axis_number: int | None = None, cache_timeout=0.1,
+                 timeout: float = 0.1, baudrate: int = 19200, rtscts: bool = True) -> None:
         self._logger = logging.getLogger(self.__class__.__name__)
         self._connection: ESP301_Connection | None = None
+        self._timeout = timeout
+        self._baudrate = baudrate
+        self._rtscts = rtscts
+        '''serial settings used by `open_connection`, see `ESP301_Connection`'''
         self._axis: int | None = None
+        self._cmds: _AxisCommands | None = None
+        self._busy_mask = 0
+        '''the bit of the TS status byte flagging motion on this axis'''
+        self._ready = False
+        '''whether both a connection and an axis are set'''
 
-        self._cache: TimeStampedDict[str, float] = TimeStampedDict()
+        self._cache = _StageCache()
         '''cache responses from the stage, to avoid polling it too often'''
 
         self._cache_timeout = cache_timeout
         '''after this much time, the contents of the cache should be disregarded'''
+        self._cache_timeout_ns = int(cache_timeout * 1e9)
 
         if port is not None:
             self.open_connection(port)
         if axis_number is not None:
             self.set_axis(axis_number)
 
-    @staticmethod
-    def list_available_ports() -> list[str]:
-        '''return a list of all available COM ports on this PC'''
-        return list(p.name for p in comports())
-
     def list_available_axes(self) -> list[str]:
         '''return a list of all available axes on this connection'''
         if self._connection is None:
             raise ConnectionError("Cannot get a connection to list devices on")
 
+        # query all axes in a single exchange
+        responses = self.connection.command_multi(
+            [f"{i}ID?" for i in range(1, 4)])
+
         axes = []
-        for i in range(1, 4):
-            self.connection.command(f"{i}ID?")
-            resp = self.connection.response()
+        for i, resp in enumerate(responses, start=1):
             if resp.lower() != b"unknown":
                 axes.append(f"{i} : {resp.decode('ascii')}")
 
@@ -101,6 +240,7 @@ class Stage:
         except RuntimeError:
             pass
         finally:
+            self._ready = False
             if self._axis:
                 self._axis = None
             if self._connection:
@@ -111,11 +251,25 @@ class Stage:
         '''the connection used to communicate with the stage device'''
         return self._connection
 
-    def open_connection(self, port: str):
-        '''open the COM port on which the stage is located'''
-        self.close()
-        self._logger.debug(f"opening connection to {port}")
-        self._connection = ESP301_Connection(port)
+    def open_connection(self, port: str, timeout: float | None = None,
+                        baudrate: int | None = None, rtscts: bool | None = None):
+        '''
+        open the COM port on which the stage is located.
+        serial settings which are given are kept for later connections.
+        '''
+        if timeout is not None:
+            self._timeout = timeout
+        if baudrate is not None:
+            self._baudrate = baudrate
+        if rtscts is not None:
+            self._rtscts = rtscts
+        if self._connection is not None:
+            self.close()
+        self._logger.debug("opening connection to %s", port)
+        self._connection = ESP301_Connection(port,
+                                             timeout=self._timeout,
+                                             baudrate=self._baudrate,
+                                             rtscts=self._rtscts)
 
     @property
     def axis(self) -> int | None:
@@ -124,8 +278,9 @@ class Stage:
 
     def set_axis(self, axis_number: int):
         '''set the axis of the stage'''
+        self._ready = False
         self._axis = None
-        self._logger.debug(f"setting axis to {axis_number}")
+        self._logger.debug("setting axis to %s", axis_number)
         if not isinstance(axis_number, int):
             raise TypeError(
                 f"axis number must be int, not {type(axis_number)}")
@@ -136,121 +291,142 @@ class Stage:
             raise ValueError("axis number must be between 1 and 3")
 
         # check that the axis is really there
-        self.connection.command(f"{axis_number}ID?")
-        if self.connection.response().lower() == b"unknown":
+        resp = self.connection.command_with_response(f"{axis_number}ID?")
+        if resp.lower() == b"unknown":
             raise RuntimeError("No such axis available")
 
         self._axis = int(axis_number)
+        self._cmds = _AxisCommands.for_axis(self._axis)
+        self._busy_mask = 1 << (self._axis - 1)
+        self._ready = True
+        self._cache = _StageCache()
 
-    def __enter__(self):
-        '''context manager to make sure connection is properly closed'''
-        return self
-
-    def __exit__(self, *args):
-        self.close()
-
-    @typing.overload
-    @staticmethod
-    def connection_check(func: typing.Callable) -> typing.Callable:
-        ...
-
-    @typing.overload
     def connection_check(self) -> None:
-        ...
-
-    def connection_check(self: 'Stage | typing.Callable'):
-        '''
-        Can be used as a decorator or an instance method.
-
-        Raises RuntimeError if the connection is not set up correctly.
-        '''
+        '''Raises RuntimeError if the connection is not set up correctly.'''
+        if self._connection is None:
+            raise RuntimeError("No connection set")
+        if self._axis is None:
+            raise RuntimeError("No axis set")
 
-        if not callable(self):  # being used as instance method
-            if not self.connection:
-                raise RuntimeError("No connection set")
-            if not self.axis:
-                raise RuntimeError("No axis set")
-        else:  # being used as decorator
-            func = self
-
-            def _func(self, *args, **kwargs):
-                if not self.connection:
-                    raise RuntimeError("No connection set")
-                if not self.axis:
-                    raise RuntimeError("No axis set")
-                return func(self, *args, **kwargs)
-            return _func
-
-    def _cached_command(self, cmd: str) -> bytes | None:
+    def _cached_command(self, slot: str, cmd: bytes) -> bytes | None:
         '''
-        send a command and place the response in a chache.
+        send a command and place the response in the cache `slot`.
         the next time this command is sent, the the cache is checked 
         for an existing recent response, and this is returned instead, 
         if it is within the response timeout period. 
         '''
-        cached_resp, timestamp = self._cache[cmd]
-        if time.time() - timestamp >= self._cache_timeout:
-            resp = self.connection.command_with_response(cmd)
-            self._cache[cmd] = resp
+        cached_resp, deadline = getattr(self._cache, slot)
+        now = time.monotonic_ns()
+        if now >= deadline:
+            resp = self.connection.query_raw(cmd)
+            setattr(self._cache, slot, (resp, now + self._cache_timeout_ns))
             return resp
         else:
             return cached_resp
 
-    @connection_check
+    @_require_conn
     def enable(self, enable: bool = True):
-        self.connection.command(f"{self._axis}M{'O' if enable else 'F'}")
+        self.connection.write_raw(
+            self._cmds.motor_on if enable else self._cmds.motor_off)
 
         # we need to invalidate the cached response to the "enabled" query
-        del self._cache[f"{self._axis}MO?"]
+        self._cache.mo = _EXPIRED
 
     def disable(self, disable: bool = True):
         self.enable(not disable)
 
-    @connection_check
+    @_require_conn
     def enabled(self) -> bool:
-        cmd = f"{self._axis}MO?"
-        rsp = self._cached_command(cmd)
+        rsp = self._cached_command('mo', self._cmds.mo_q)
         return rsp == b'1'
 
-    @connection_check
+    @_require_conn
     def goto_home(self):
-        self.connection.command(f"{self._axis}OR")
+        self.connection.write_raw(self._cmds.home)
         # we need to invalidate the cached response to the "is busy" query
-        del self._cache['TS']
+        self._cache.ts = _EXPIRED
 
-    @connection_check
+    @_require_conn
     def is_busy(self) -> bool:
-        cmd = f"TS"
-        rsp = self._cached_command(cmd)
-        return bool((int.from_bytes(rsp) >> (self.axis - 1)) & 1)
-
-    @connection_check
+        rsp = self._cached_command('ts', b"TS\r\n")
+        return self._parse_busy(rsp)
+
+    def _parse_busy(self, rsp: bytes) -> bool:
+        '''parse the response to a TS query, for the current axis'''
+        # TS answers with a single character, whose bits are the
+        # motion-in-progress flags of each axis
+        if not rsp:
+            raise TimeoutError("no reply to TS")
+        return bool(rsp[0] & self._busy_mask)
+
+    @_require_conn
     def get_position(self) -> float:
-        cmd = f"{self._axis}PA?"
-        rsp = self._cached_command(cmd)
+        rsp = self._cached_command('pa', self._cmds.pa_q)
         return float(rsp)
 
-    @connection_check
+    @_require_conn
     def goto_position(self, pos: float):
         '''Go to a given position. non-blocking '''
-        cmd = f"{self._axis}PA{pos:.4f}"
-        self.connection.command(cmd)
+        self.connection.write_raw(self._cmds.pa_fmt % pos)
 
         # we need to invalidate the cached response to the "is busy" query
-        del self._cache[f"TS"]
+        self._cache.ts = _EXPIRED
+
+    @_require_conn
+    def goto_position_checked(self, pos: float) -> tuple[int, str]:
+        '''
+        Go to a given position, and return the error status right after
+        the command was accepted, in a single exchange. non-blocking
+        '''
+        rsp = self.connection.query_raw(self._cmds.pa_checked_fmt % pos)
+        self._cache.ts = _EXPIRED
+        return self._parse_error(rsp)
 
-    @connection_check
+    @_require_conn
     def get_velocity(self) -> float:
-        cmd = f"{self._axis}VA?"
-        rsp = self._cached_command(cmd)
+        rsp = self._cached_command('va', self._cmds.va_q)
         return float(rsp)
 
-    @connection_check
+    @_require_conn
     def stop(self):
-        self.connection.command(f"{self._axis}ST")
+        self.connection.write_raw(self._cmds.stop)
 
         # we need to invalidate the cached response to the "is busy" query
-        del self._cache[f"TS"]
+        self._cache.ts = _EXPIRED
+
+    @_require_conn
+    def home_and_wait(self, timeout: float = 30.):
+        '''
+        enable the motor, home, and wait until done, in a single exchange.
+        the connection is blocked until the axis stops, so this should not
+        be used while the stage is also controlled from a GUI.
+        '''
+        self._await_motion(self._cmds.home_and_wait, timeout)
+
+    @_require_conn
+    def goto_position_and_wait(self, pos: float, timeout: float = 30.):
+        '''
+        go to a given position, and wait until done, in a single exchange.
+        the connection is blocked until the axis stops, so this should not
+        be used while the stage is also controlled from a GUI.
+        '''
+        self._await_motion(self._cmds.pa_and_wait_fmt % pos, timeout)
+
+    def _await_motion(self, cmd: bytes, timeout: float):
+        '''
+        send a motion command chained with `WS` and `TB`. the controller
+        only answers the `TB` once the axis has stopped.
+        '''
+        # stopping ends the wait, so the late error status can be drained
+        rsp = self.connection.query_or_abort_raw(
+            cmd, timeout, self._cmds.stop, self.STOP_TIMEOUT)
+        self._cache.mo = self._cache.pa = self._cache.ts = _EXPIRED
+        if not rsp:
+            raise TimeoutError(f"motion did not complete within {timeout}s")
+
+        ec, msg = self._parse_error(rsp)
+        if ec != 0:
+            raise RuntimeError(f"MOTOR ERROR {ec} : {msg}")
 
     def wait_until_done(self):
         '''wait until the stage is no longer busy'''
@@ -265,49 +441,39 @@ class Stage:
         if ec != 0:
             raise RuntimeError(f"MOTOR ERROR {ec} : {msg}")
 
-    @connection_check
+    @_require_conn
     def error_status(self) -> tuple[int, str]:
         '''check the current error status'''
-        rsp = self.connection.command_with_response("TB")
+        rsp = self.connection.query_raw(b"TB\r\n")
+        return self._parse_error(rsp)
+
+    @staticmethod
+    def _parse_error(rsp: bytes) -> tuple[int, str]:
+        '''parse the response to a TB query'''
         err_code, _, err_msg = rsp.split(b", ")
         return int(err_code), err_msg.decode("ascii")
 
-    def interactive_setup(self):
-        '''interactively set up a Stage object, using command-line prompts for input'''
-
-        # find out which COM port are available
-        print("The following COM ports have been detected : ")
-        ports = self.list_available_ports()
-        if len(ports):
-            print(*ports, sep='\n')
-        else:
-            raise RuntimeError(
-                "No COM ports detected -- make sure your device is connected and powered on")
-
-        # open connection to stage
-        port = input("which COM port would you like to use ? (int) ")
-        if not port.isnumeric():
-            raise TypeError("expected a COM port number")
-        self.open_connection(f"COM{port}")
-
-        # find out which axes are available
-        axes = self.list_available_axes()
-        if len(axes):
-            print(*axes, sep='\n')
-        else:
-            raise RuntimeError("No axes detected")
+    @_require_conn
+    def snapshot(self) -> StageSnapshot:
+        '''
+        read the error status, position, busy and enabled state of the
+        axis in a single exchange. the responses also refresh the cache.
+        '''
+        tb, pa, ts, mo = self.connection.query_multi_raw(self._cmds.snapshot, 4)
+        deadline = time.monotonic_ns() + self._cache_timeout_ns
+        self._cache.pa = (pa, deadline)
+        self._cache.ts = (ts, deadline)
+        self._cache.mo = (mo, deadline)
 
-        # open connection to axis
-        axis_number = input(
-            "which axis would you like to use ? (int) ")
-        if not axis_number.isnumeric():
-            raise TypeError("expected an axis number")
-        self.set_axis(int(axis_number))
+        err_code, err_msg = self._parse_error(tb)
+        return StageSnapshot(position=float(pa),
+                             busy=self._parse_busy(ts),
+                             enabled=mo == b'1',
+                             err_code=err_code,
+                             err_msg=err_msg)
 
 
 def main():
-    import time
-
     with Stage() as stage:
         # do setup
         stage.interactive_setup()
@@ -322,7 +488,6 @@ def main():
                 break
             except Exception as e:
                 print(e)
-            time.sleep(.1)
 
 
 if __name__ == "__main__":
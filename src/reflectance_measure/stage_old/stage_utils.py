@@ -1,10 +1,12 @@
 import typing
 import logging
+import functools
 
-from serial.tools.list_ports import comports
+from reflectance_measure.stage.stage_base import StageBase
 
-from zaber_motion import Units
-from zaber_motion.ascii import Connection, Device, Axis
+if typing.TYPE_CHECKING:
+    from zaber_motion import Units
+    from zaber_motion.ascii import Connection, Device, Axis
 
 __all__ = [
     "Stage",
@@ -12,7 +14,22 @@ __all__ = [
 ]
 
 
-class Stage:
+@functools.cache
+def _zaber_ascii():
+    '''import zaber_motion.ascii on first use, as it is slow to import'''
+    import zaber_motion.ascii
+    return zaber_motion.ascii
+
+
+def __getattr__(name: str):
+    # `Units` is re-exported, but zaber_motion is only imported on access
+    if name == "Units":
+        from zaber_motion import Units
+        return Units
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class Stage(StageBase):
     def __init__(self, port: str | None = None, device_address: int | None = None, axis_number: int | None = None) -> None:
         self._logger = logging.getLogger(self.__class__.__name__)
         self._connection: Connection | None = None
@@ -26,13 +43,6 @@ class Stage:
         if axis_number is not None:
             self.set_axis(axis_number)
 
-    @staticmethod
-    def list_available_ports() -> list[str]:
-        '''return a list of all available COM ports on this PC'''
-        return list(p.name for p in comports())
-
-        ...
-
     @typing.overload
     def list_available_devices(self) -> list[str]:
         '''return a list of all available devices on the same COM port as this device'''
@@ -47,7 +57,7 @@ class Stage:
         if isinstance(self_or_port, Stage):
             con = self_or_port._connection
         elif isinstance(self_or_port, str):
-            con = Connection.open_serial_port(self_or_port)
+            con = _zaber_ascii().Connection.open_serial_port(self_or_port)
         else:
             con = None
 
@@ -77,7 +87,7 @@ class Stage:
             if not isinstance(device_address, int):
                 raise ValueError(
                     "must specify device_address as (int) when calling as static method")
-            con = Connection.open_serial_port(self_or_port)
+            con = _zaber_ascii().Connection.open_serial_port(self_or_port)
             dev = con.get_device(device_address)
         else:
             dev = None
@@ -98,7 +108,7 @@ class Stage:
             self._connection.close()
 
     @property
-    def connection(self) -> Connection | None:
+    def connection(self) -> 'Connection | None':
         '''the connection used to communicate with the stage device'''
         return self._connection
 
@@ -106,10 +116,10 @@ class Stage:
         '''open the COM port on which the stage is located'''
         self.close()
         self._logger.debug(f"opening connection to {port}")
-        self._connection = Connection.open_serial_port(port)
+        self._connection = _zaber_ascii().Connection.open_serial_port(port)
 
     @property
-    def device(self) -> Device | None:
+    def device(self) -> 'Device | None':
         '''the device on which the stage is located'''
         return self._device
 
@@ -124,7 +134,7 @@ class Stage:
         self._device = self._connection.get_device(device_address)
 
     @property
-    def axis(self) -> Axis | None:
+    def axis(self) -> 'Axis | None':
         '''the axis of the stage'''
         return self._axis
 
@@ -137,30 +147,8 @@ class Stage:
                 "no device set. cannot get the requested axis")
         self._axis = self._device.get_axis(axis_number)
 
-    def __enter__(self):
-        '''context manager to make sure connection is properly closed'''
-        return self
-
-    def __exit__(self, *args):
-        self.close()
-
-    def interactive_setup(self):
-        '''interactively set up a Stage object, using command-line prompts for input'''
-
-        # find out which COM port are available
-        print("The following COM ports have been detected : ")
-        ports = self.list_available_ports()
-        if len(ports):
-            print(*ports, sep='\n')
-        else:
-            raise RuntimeError(
-                "No COM ports detected -- make sure your device is connected and powered on")
-
-        # open connection to stage
-        port = input("which COM port would you like to use ? (int) ")
-        if not port.isnumeric():
-            raise TypeError("expected a COM port number")
-        self.open_connection(f"COM{port}")
+    def _interactive_setup_device(self):
+        '''interactively select the device on the open connection'''
 
         # find out which devices are available
         devices = self.list_available_devices()
@@ -176,23 +164,10 @@ class Stage:
             raise TypeError("expected a device address number")
         self.set_device(int(device_address))
 
-        # find out which axes are available
-        axes = self.list_available_axes()
-        if len(axes):
-            print(*axes, sep='\n')
-        else:
-            raise RuntimeError("No axes detected")
-
-        # open connection to axis
-        axis_number = input(
-            "which axis would you like to use ? (int) ")
-        if not axis_number.isnumeric():
-            raise TypeError("expected an axis number")
-        self.set_axis(int(axis_number))
-
 
 def main():
     import time
+    from zaber_motion import Units
 
     with Stage() as stage:
         # do setup